@@ -2,8 +2,12 @@
 import requests
 import json
 import time
+import bisect
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # ==========================================
 # 核心功能: 获取实时估值 (极简高效版)
@@ -47,6 +51,818 @@ def get_fund_real_time_value(fund_code):
     except Exception as e:
         return None
 
-# 占位函数，防止报错
-def get_fund_portfolio(fund_code): pass
-def get_manager_start_date(fund_code): pass
+# ==========================================
+# 财富净值走势: 增量缓存 + LTTB 降采样
+# ==========================================
+# 区间视图 -> 回看天数 (None 表示全部)
+WEALTH_RANGES = {"1M": 30, "6M": 182, "1Y": 365, "ALL": None}
+# 单次图表最多下发给浏览器的点数
+WEALTH_MAX_POINTS = 240
+
+
+def update_wealth_curve(curve, asset_history):
+    """
+    根据 asset_history 增量更新已排序的净值序列
+    curve 为 None 时全量构建；只有今日数值变化或新增一天时，只改最后一个点
+    """
+    if curve is not None and len(asset_history) == len(curve['keys']):
+        # 日期集合完全一致时只有今日数值在变，原地更新最后一个点 (只比较键，不解析日期)
+        if curve['keys'] and asset_history.keys() == curve['key_set']:
+            curve['values'][-1] = float(asset_history[curve['keys'][-1]])
+            return curve
+    elif curve is not None and len(asset_history) == len(curve['keys']) + 1:
+        new_keys = [k for k in asset_history if k not in curve['key_set']]
+        if len(new_keys) == 1 and (not curve['keys'] or new_keys[0] > curve['keys'][-1]):
+            # 新的一天，追加到末尾
+            key = new_keys[0]
+            curve['keys'].append(key)
+            curve['key_set'].add(key)
+            curve['dates'].append(datetime.strptime(key, "%Y-%m-%d"))
+            curve['values'].append(float(asset_history[key]))
+            return curve
+
+    # 首次或历史被改动(清空/导入)，全量重建
+    keys = sorted(asset_history)
+    return {
+        "keys": keys,
+        "key_set": set(keys),
+        "dates": [datetime.strptime(k, "%Y-%m-%d") for k in keys],
+        "values": [float(asset_history[k]) for k in keys],
+    }
+
+
+def lttb_downsample(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降采样，保留走势的形状
+    xs 为数值横坐标 (如时间戳)，返回被选中点的下标列表
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 下一个桶的平均点
+        avg_start = int((i + 1) * bucket_size) + 1
+        avg_end = min(int((i + 2) * bucket_size) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / avg_len
+        avg_y = sum(ys[avg_start:avg_end]) / avg_len
+
+        # 当前桶内选出与 a 点、平均点构成最大三角形的点
+        range_start = int(i * bucket_size) + 1
+        range_end = int((i + 1) * bucket_size) + 1
+        ax, ay = xs[a], ys[a]
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        selected.append(next_a)
+        a = next_a
+
+    selected.append(n - 1)
+    return selected
+
+
+def get_wealth_chart_df(curve, range_key="ALL", max_points=WEALTH_MAX_POINTS):
+    """
+    从缓存的净值序列中切出指定区间，并降采样到不超过 max_points 个点
+    """
+    dates, values = curve['dates'], curve['values']
+    days = WEALTH_RANGES.get(range_key)
+    start = 0
+    if days is not None and dates:
+        start = bisect.bisect_left(dates, dates[-1] - timedelta(days=days))
+    dates, values = dates[start:], values[start:]
+
+    if len(dates) > max_points:
+        xs = [d.timestamp() for d in dates]
+        idx = lttb_downsample(xs, values, max_points)
+        dates = [dates[i] for i in idx]
+        values = [values[i] for i in idx]
+
+    return pd.DataFrame({"总资产": values}, index=pd.DatetimeIndex(dates, name="日期"))
+
+
+# ==========================================
+# 本地 JSON 缓存 (磁盘 + 内存)
+# ==========================================
+_json_caches = {}
+# 多个会话/线程会同时读写缓存，修改和落盘都要持有这把锁
+_json_cache_lock = threading.RLock()
+
+
+def _load_json_cache(file_path):
+    """读取本地缓存文件，进程内只读一次磁盘"""
+    with _json_cache_lock:
+        if file_path not in _json_caches:
+            data = {}
+            if os.path.exists(file_path):
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except:
+                    data = {}
+            _json_caches[file_path] = data
+        return _json_caches[file_path]
+
+
+def _save_json_cache(file_path):
+    with _json_cache_lock:
+        try:
+            content = json.dumps(_json_caches.get(file_path, {}), ensure_ascii=False)
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+        except Exception as e:
+            print(f"缓存保存失败: {e}")
+
+
+# 天天基金 App 接口的公共参数
+MOB_API_PARAMS = {"deviceid": "Wap", "plat": "Wap", "product": "EFund", "version": "2.0.0"}
+MOB_API_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148",
+    "Referer": "https://mpservice.com/"
+}
+
+
+# ==========================================
+# 基金持仓 (季报前十大重仓股 / 债)
+# ==========================================
+PORTFOLIO_CACHE_FILE = "fund_portfolio_cache.json"
+# 季报在季度结束后 15 个工作日内披露，按 25 个自然日估算
+PORTFOLIO_DISCLOSE_DAYS = 25
+
+
+def get_report_quarter(date_str):
+    """'2024-09-30' -> '2024Q3'"""
+    d = datetime.strptime(date_str[:10], "%Y-%m-%d")
+    return f"{d.year}Q{(d.month - 1) // 3 + 1}"
+
+
+def get_latest_disclosed_quarter(now=None):
+    """当前时间点应该已经披露的最新报告期"""
+    now = now or datetime.now()
+    year, quarter = now.year, (now.month - 1) // 3 + 1
+    # 从上一个季度往前找，直到披露期已过
+    for _ in range(3):
+        quarter -= 1
+        if quarter == 0:
+            year, quarter = year - 1, 4
+        quarter_end = datetime(year + (quarter == 4), (quarter * 3) % 12 + 1, 1) - timedelta(days=1)
+        if now >= quarter_end + timedelta(days=PORTFOLIO_DISCLOSE_DAYS):
+            break
+    return f"{year}Q{quarter}"
+
+
+def _fetch_fund_portfolio(fund_code):
+    url = "https://fundmobapi.eastmoney.com/FundMNewApi/FundMNInverstPosition"
+    params = dict(MOB_API_PARAMS, FCODE=fund_code)
+    response = requests.get(url, params=params, headers=MOB_API_HEADERS, timeout=5)
+    if response.status_code != 200:
+        return None
+    payload = response.json()
+    datas = payload.get('Datas') or {}
+    report_date = payload.get('Expansion') or ""
+    if not report_date:
+        # 货币基金等不披露持仓，返回空结果以便缓存，避免每次都重新请求
+        return {"报告期": "", "报告日期": "", "股票": [], "债券": []}
+
+    stocks = [{
+        "代码": item.get('GPDM', ''),
+        "名称": item.get('GPJC', ''),
+        "占净值比例": float(item.get('JZBL') or 0),
+        "行业": item.get('INDEXNAME') or "其他",
+    } for item in datas.get('fundStocks') or []]
+    bonds = [{
+        "代码": item.get('ZQDM', ''),
+        "名称": item.get('ZQMC', ''),
+        "占净值比例": float(item.get('ZJZBL') or 0),
+    } for item in datas.get('fundboods') or []]
+
+    return {
+        "报告期": get_report_quarter(report_date),
+        "报告日期": report_date[:10],
+        "股票": stocks,
+        "债券": bonds,
+    }
+
+
+def _load_fund_portfolio(fund_code):
+    """
+    读取缓存或重新请求单只基金的持仓，只更新内存缓存不落盘
+    返回 (持仓, 是否更新了缓存)
+    """
+    cache = _load_json_cache(PORTFOLIO_CACHE_FILE)
+    cached = cache.get(fund_code)
+    today = datetime.now().strftime("%Y-%m-%d")
+    if cached and (cached['报告期'] >= get_latest_disclosed_quarter() or cached.get('检查日期') == today):
+        return cached, False
+
+    try:
+        result = _fetch_fund_portfolio(fund_code)
+    except Exception:
+        result = None
+    if result is None:
+        return cached, False
+
+    result['检查日期'] = today
+    with _json_cache_lock:
+        cache[fund_code] = result
+    return result, True
+
+
+def get_fund_portfolio(fund_code):
+    """
+    获取基金最新披露的重仓股票和债券
+    结果按报告期缓存在本地，新季报披露前不会重复请求 (每天最多重试一次)
+    """
+    result, changed = _load_fund_portfolio(fund_code)
+    if changed:
+        _save_json_cache(PORTFOLIO_CACHE_FILE)
+    return result
+
+
+def get_fund_portfolios(fund_codes, max_workers=8):
+    """
+    并发获取多只基金的持仓，全部完成后统一落盘一次
+    返回 {代码: get_fund_portfolio 的结果}
+    """
+    fund_codes = list(fund_codes)
+    if not fund_codes:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(fund_codes))) as pool:
+        results = list(pool.map(_load_fund_portfolio, fund_codes))
+    if any(changed for _, changed in results):
+        _save_json_cache(PORTFOLIO_CACHE_FILE)
+    return {code: result for code, (result, _) in zip(fund_codes, results)}
+
+
+def build_holding_matrix(portfolios):
+    """
+    把多只基金的持仓转成稀疏矩阵 (CSR 行结构): 每只基金一行，只存非零的 (列号, 权重)
+    portfolios: {基金代码: get_fund_portfolio 的结果}
+    """
+    columns = {}     # (类型, 代码) -> 列号
+    column_info = []  # 列号 -> 证券信息
+    rows = {}
+    for fund_code, portfolio in portfolios.items():
+        if not portfolio:
+            continue
+        row = []
+        for kind in ("股票", "债券"):
+            for item in portfolio.get(kind, []):
+                key = (kind, item['代码'])
+                if key not in columns:
+                    columns[key] = len(column_info)
+                    column_info.append({
+                        "类型": kind,
+                        "代码": item['代码'],
+                        "名称": item['名称'],
+                        "行业": item.get('行业', "债券"),
+                    })
+                row.append((columns[key], item['占净值比例'] / 100))
+        rows[fund_code] = row
+    return {"rows": rows, "columns": column_info}
+
+
+def calc_look_through_exposure(position_values, matrix):
+    """
+    穿透计算: 持仓市值向量 × 基金持仓稀疏矩阵 = 对每只证券的真实暴露
+    position_values: {基金代码: 当前市值}
+    返回 (证券暴露 DataFrame, 行业暴露 DataFrame)，按暴露金额降序
+    """
+    exposure = {}
+    for fund_code, value in position_values.items():
+        for col, weight in matrix['rows'].get(fund_code, ()):
+            exposure[col] = exposure.get(col, 0.0) + value * weight
+
+    total = sum(position_values.values())
+    security_df = pd.DataFrame(
+        [dict(matrix['columns'][col], 暴露金额=amount) for col, amount in exposure.items()],
+        columns=["类型", "代码", "名称", "行业", "暴露金额"])
+    security_df['占总资产'] = security_df['暴露金额'] / total * 100 if total > 0 else 0.0
+    security_df = security_df.sort_values('暴露金额', ascending=False, ignore_index=True)
+
+    sector_df = (security_df.groupby('行业', as_index=False)[['暴露金额', '占总资产']].sum()
+                 .sort_values('暴露金额', ascending=False, ignore_index=True))
+    return security_df, sector_df
+
+
+# ==========================================
+# 基金基础信息 (经理 / 类型 / 费率 / 成立日)
+# ==========================================
+META_CACHE_FILE = "fund_meta_cache.json"
+DAY = 24 * 3600
+# 各字段的有效期 (秒)，None 表示永不过期
+META_FIELD_TTL = {
+    "名称": 30 * DAY,
+    "类型": 30 * DAY,
+    "成立日期": None,
+    "QDII": None,
+    "申购费率": 1 * DAY,
+    "原申购费率": 7 * DAY,
+    "基金经理": 7 * DAY,
+    "任职日期": 7 * DAY,
+}
+
+
+def _fetch_base_info(fund_code):
+    url = "https://fundmobapi.eastmoney.com/FundMApi/FundBaseTypeInformation.ashx"
+    response = requests.get(url, params=dict(MOB_API_PARAMS, FCODE=fund_code), headers=MOB_API_HEADERS, timeout=5)
+    datas = response.json().get('Datas') or {}
+    if not datas:
+        return {}
+    fund_type = datas.get('FTYPE') or ""
+    name = datas.get('SHORTNAME') or ""
+    return {
+        "名称": name,
+        "类型": fund_type,
+        "成立日期": datas.get('ESTABDATE') or "",
+        "QDII": "QDII" in fund_type or "QDII" in name,
+        "申购费率": datas.get('RATE') or "",
+        "原申购费率": datas.get('SOURCERATE') or "",
+    }
+
+
+def _fetch_manager_info(fund_code):
+    url = "https://fundmobapi.eastmoney.com/FundMApi/FundManagerList.ashx"
+    response = requests.get(url, params=dict(MOB_API_PARAMS, FCODE=fund_code), headers=MOB_API_HEADERS, timeout=5)
+    managers = response.json().get('Datas') or []
+    if not managers:
+        return {}
+    # 多位经理共管时，取任职最早的一位作为起始日期
+    start_dates = [m.get('FEMPDATE') for m in managers if m.get('FEMPDATE')]
+    return {
+        "基金经理": "、".join(m.get('MGRNAME', '') for m in managers),
+        "任职日期": min(start_dates) if start_dates else "",
+    }
+
+
+# 字段 -> 负责获取它的接口
+_META_FETCHERS = {
+    _fetch_base_info: ("名称", "类型", "成立日期", "QDII", "申购费率", "原申购费率"),
+    _fetch_manager_info: ("基金经理", "任职日期"),
+}
+# 请求失败后的冷却期，避免每次刷新都重试
+META_RETRY_SECONDS = 600
+_meta_retry_after = {}
+
+
+def _stale_meta_fetchers(fund_code, entry, now):
+    """返回需要刷新的接口列表"""
+    stale = []
+    for fetcher, fields in _META_FETCHERS.items():
+        if _meta_retry_after.get((fund_code, fetcher), 0) > now:
+            continue
+        for field in fields:
+            record = entry.get(field)
+            ttl = META_FIELD_TTL[field]
+            if record is None or (ttl is not None and now - record[1] > ttl):
+                stale.append(fetcher)
+                break
+    return stale
+
+
+def _refresh_fund_meta(fund_code, fetchers, now):
+    cache = _load_json_cache(META_CACHE_FILE)
+    changed = False
+    for fetcher in fetchers:
+        try:
+            values = fetcher(fund_code)
+        except Exception:
+            values = {}
+        if not values:
+            _meta_retry_after[(fund_code, fetcher)] = now + META_RETRY_SECONDS
+            continue
+        # 请求在锁外并发进行，只有写入共享缓存时加锁
+        with _json_cache_lock:
+            entry = cache.setdefault(fund_code, {})
+            for field, value in values.items():
+                entry[field] = [value, now]
+        changed = True
+    return changed
+
+
+def prefetch_fund_meta(fund_codes, max_workers=8):
+    """
+    批量预取基金基础信息，只请求缺失或过期的字段，并发执行后统一落盘一次
+    """
+    cache = _load_json_cache(META_CACHE_FILE)
+    now = time.time()
+    jobs = {}
+    for code in set(fund_codes):
+        fetchers = _stale_meta_fetchers(code, cache.get(code, {}), now)
+        if fetchers:
+            jobs[code] = fetchers
+    if not jobs:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda code: _refresh_fund_meta(code, jobs[code], now), jobs))
+    if any(results):
+        _save_json_cache(META_CACHE_FILE)
+
+
+def get_fund_meta(fund_code):
+    """
+    获取单只基金的基础信息，内存命中时直接返回，不发请求
+    返回 {字段: 值}
+    """
+    prefetch_fund_meta([fund_code])
+    with _json_cache_lock:
+        entry = _load_json_cache(META_CACHE_FILE).get(fund_code, {})
+        return {field: record[0] for field, record in entry.items()}
+
+
+def get_fund_name(fund_code, quote=None):
+    """基金名称优先取基础信息缓存，取不到时用实时估值里的名称"""
+    name = get_fund_meta(fund_code).get("名称")
+    if not name and quote:
+        name = quote.get('名称')
+    return name or fund_code
+
+
+def get_manager_start_date(fund_code):
+    """现任基金经理的任职起始日期，如 '2015-06-12'，获取失败返回 None"""
+    return get_fund_meta(fund_code).get("任职日期") or None
+
+
+# ==========================================
+# 价格提醒引擎
+# ==========================================
+# 规则: {"id": 唯一标识, "类型": ALERT_TYPES 之一, "代码": 基金代码 ("日收益" 用 "*"),
+#        "方向": "上破" / "下破", "阈值": 数值}
+ALERT_TYPES = {
+    "涨幅": "估算涨幅(%)",
+    "净值": "实时估值",
+    "回撤": "持有收益率(%)",
+    "日收益": "组合今日收益(元)",
+}
+PORTFOLIO_CODE = "*"
+
+
+def _quote_metrics(quote, position=None):
+    """从一条实时估值中算出各类提醒要比较的指标"""
+    price = float(quote['实时估算值'])
+    metrics = {
+        "涨幅": float(quote['估算涨幅'].replace('%', '')),
+        "净值": price,
+    }
+    if position and position.get('cost', 0) > 0:
+        metrics["回撤"] = (position['shares'] * price - position['cost']) / position['cost'] * 100
+    return metrics
+
+
+class AlertEngine:
+    """
+    按 (代码, 类型, 方向) 建索引，阈值有序存放
+    每次轮询只处理估值版本变化了的基金，用二分查找直接定位被触发的规则
+    """
+
+    def __init__(self, rules=()):
+        self._versions = {}  # 代码 -> 上次评估时的估值版本
+        self._fired = {}     # 规则 id -> 触发日期，同一规则每天只提醒一次
+        self.set_rules(rules)
+
+    def set_rules(self, rules):
+        index = {}
+        for rule in rules:
+            key = (rule['代码'], rule['类型'], rule['方向'])
+            index.setdefault(key, []).append((float(rule['阈值']), rule['id'], rule))
+        self._index = {}
+        for key, items in index.items():
+            items.sort(key=lambda item: (item[0], item[1]))
+            self._index[key] = ([item[0] for item in items], [item[2] for item in items])
+        self._codes = {key[0] for key in self._index}
+        # 规则变了，下次轮询全部重新评估
+        self._versions = {}
+
+    def _match(self, code, alert_type, value):
+        """返回被 value 触发的规则"""
+        hits = []
+        above = self._index.get((code, alert_type, "上破"))
+        if above:
+            hits.extend(above[1][:bisect.bisect_right(above[0], value)])
+        below = self._index.get((code, alert_type, "下破"))
+        if below:
+            hits.extend(below[1][bisect.bisect_left(below[0], value):])
+        return hits
+
+    def evaluate(self, quotes, holdings=None):
+        """
+        quotes: {代码: get_fund_real_time_value 的结果}
+        holdings: {代码: {"shares", "cost", ...}}，用于回撤和组合日收益
+        返回本次新触发的提醒列表
+        """
+        holdings = holdings or {}
+        today = datetime.now().strftime("%Y-%m-%d")
+        triggered = []
+        changed = False
+
+        for code, quote in quotes.items():
+            if not quote:
+                continue
+            position = holdings.get(code)
+            version = (quote['更新时间'], quote['实时估算值'],
+                       (position['shares'], position['cost']) if position else None)
+            if self._versions.get(code) == version:
+                continue
+            self._versions[code] = version
+            changed = True
+            if code not in self._codes:
+                continue
+
+            for alert_type, value in _quote_metrics(quote, position).items():
+                for rule in self._match(code, alert_type, value):
+                    triggered.append((rule, value, quote['名称']))
+
+        if changed and PORTFOLIO_CODE in self._codes:
+            day_profit = 0.0
+            for code, position in holdings.items():
+                quote = quotes.get(code)
+                if quote:
+                    day_profit += position['shares'] * float(quote['实时估算值']) * \
+                                  float(quote['估算涨幅'].replace('%', '')) / 100
+            for rule in self._match(PORTFOLIO_CODE, "日收益", day_profit):
+                triggered.append((rule, day_profit, "组合"))
+
+        alerts = []
+        for rule, value, name in triggered:
+            if self._fired.get(rule['id']) == today:
+                continue
+            self._fired[rule['id']] = today
+            label = ALERT_TYPES[rule['类型']]
+            target = "" if rule['代码'] == PORTFOLIO_CODE else f"{name}({rule['代码']}) "
+            alerts.append({
+                "规则": rule,
+                "当前值": value,
+                "消息": f"{target}{label} {value:+.2f}，已{rule['方向']} {float(rule['阈值']):.2f}",
+            })
+        return alerts
+
+
+# ==========================================
+# 增量估值: 只重算估值版本或持仓变化了的基金
+# ==========================================
+def _profit_color(value):
+    return 'red' if value > 0 else 'green' if value < 0 else 'black'
+
+
+def new_valuation_memo():
+    return {
+        "rows": {},  # 代码 -> {"version": 估值版本, "row": 持仓明细行}
+        "总资产": 0.0,
+        "总本金": 0.0,
+        "今日收益": 0.0,
+        "更新时间": "等待刷新...",
+    }
+
+
+def _value_holding(code, info, quote):
+    curr_price = float(quote['实时估算值'])
+    zhangfu = float(quote['估算涨幅'].replace('%', ''))
+    market_val = info['shares'] * curr_price
+    cost = info['cost']
+    day_profit = market_val * (zhangfu / 100)
+    return {
+        "代码": code,
+        "名称": f"{info['name']} ({code})",
+        "投入本金": cost,
+        "当前市值": market_val,
+        "今日涨幅(%)": f"{zhangfu:+.2f}%",
+        "今日收益": day_profit,
+        "持有收益": market_val - cost,
+        "持有收益率": (market_val - cost) / cost * 100 if cost > 0 else 0,
+        "更新时间": quote['更新时间'],
+        # 预先算好的显示颜色，渲染时不再解析
+        "今日涨幅颜色": _profit_color(zhangfu),
+        "今日收益颜色": _profit_color(day_profit),
+        "持有收益颜色": _profit_color(market_val - cost),
+    }
+
+
+def _apply_row_delta(memo, row, sign):
+    memo['总资产'] += sign * row['当前市值']
+    memo['总本金'] += sign * row['投入本金']
+    memo['今日收益'] += sign * row['今日收益']
+
+
+def update_valuation(memo, holdings, quotes):
+    """
+    按估值版本 (gztime + 估值) 和持仓 (份额/本金) 增量更新估值结果，组合合计按差值调整
+    holdings: {代码: {"name", "shares", "cost"}}
+    quotes: {代码: get_fund_real_time_value 的结果，获取失败为 None}
+    返回按 holdings 顺序排列的持仓明细行
+    """
+    rows = memo['rows']
+    changed = False
+
+    # 已经不在持仓里的基金，从合计中扣除
+    for code in [c for c in rows if c not in holdings]:
+        _apply_row_delta(memo, rows.pop(code)['row'], -1)
+        changed = True
+
+    for code, info in holdings.items():
+        quote = quotes.get(code)
+        if not quote:
+            # 没拿到估值时与原逻辑一致: 不计入合计
+            if code in rows:
+                _apply_row_delta(memo, rows.pop(code)['row'], -1)
+                changed = True
+            continue
+
+        version = (quote['更新时间'], quote['实时估算值'], quote['估算涨幅'],
+                   info['name'], info['shares'], info['cost'])
+        cached = rows.get(code)
+        if cached and cached['version'] == version:
+            continue
+
+        row = _value_holding(code, info, quote)
+        if cached:
+            _apply_row_delta(memo, cached['row'], -1)
+        _apply_row_delta(memo, row, 1)
+        rows[code] = {"version": version, "row": row}
+        changed = True
+
+    if changed:
+        memo['更新时间'] = max((r['row']['更新时间'] for r in rows.values()), default="等待刷新...")
+    return [rows[code]['row'] for code in holdings if code in rows]
+
+
+# ==========================================
+# 批量估值 + 本地快照 (启动时先展示上次的数据)
+# ==========================================
+def get_fund_real_time_values(fund_codes, max_workers=8):
+    """
+    并发获取多只基金的实时估值
+    返回 {代码: 估值结果}，获取失败的为 None
+    """
+    fund_codes = list(fund_codes)
+    if not fund_codes:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(fund_codes))) as pool:
+        return dict(zip(fund_codes, pool.map(get_fund_real_time_value, fund_codes)))
+
+
+def save_quote_snapshot(file_path, quotes, fund_codes=None):
+    """
+    把最近一次成功获取的估值合并进本地快照 (紧凑格式)
+    获取失败的基金保留快照里的旧值；一条都没成功时不写文件
+    fund_codes: 只保留这些基金，用于清理已删除的基金
+    """
+    fresh = {code: quote for code, quote in quotes.items() if quote}
+    if not fresh:
+        return
+    merged, _ = load_quote_snapshot(file_path)
+    merged.update(fresh)
+    if fund_codes is not None:
+        merged = {code: quote for code, quote in merged.items() if code in fund_codes}
+    snapshot = {
+        "保存时间": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "估值": merged,
+    }
+    try:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+    except Exception as e:
+        print(f"快照保存失败: {e}")
+
+
+def load_quote_snapshot(file_path):
+    """
+    读取本地估值快照
+    返回 ({代码: 估值结果}, 保存时间)，没有快照时返回 ({}, None)
+    """
+    if not os.path.exists(file_path):
+        return {}, None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        return snapshot.get("估值", {}), snapshot.get("保存时间")
+    except:
+        return {}, None
+
+
+# ==========================================
+# 再平衡: 按目标权重生成买卖指令 (向量化，支持多用户批量)
+# ==========================================
+REBALANCE_COLUMNS = ["用户", "代码", "操作", "金额", "份额", "价格", "预估费用"]
+
+
+def split_rebalance_targets(targets, fund_codes, categories=None):
+    """
+    把目标分成可执行和无法执行两部分，返回 (可执行, 无法执行)
+    基金没有价格、或类别下没有可分摊的基金时无法执行；这部分权重不参与归一化，否则会把组合卖成闲置现金
+    """
+    categories = categories or {}
+    fund_codes = set(fund_codes)
+    # 直接按代码指定了权重的基金不参与类别分摊
+    category_members = {categories.get(c) for c in fund_codes if not targets.get(c) and categories.get(c)}
+    reachable, dropped = {}, {}
+    for key, weight in targets.items():
+        if key in fund_codes or key in category_members:
+            reachable[key] = weight
+        else:
+            dropped[key] = weight
+    return reachable, dropped
+
+
+def _target_weights(frame, targets, categories):
+    """
+    把目标权重 (基金代码或类别 -> 权重) 展开到每只基金
+    类别内按当前市值分摊，类别内都没有市值时平均分摊；未出现在目标里的基金目标为 0
+    """
+    total_weight = sum(targets.values())
+    if total_weight <= 0:
+        return pd.Series(0.0, index=frame.index)
+    fund_w = frame['代码'].map(lambda c: targets.get(c, 0.0)).astype(float)
+
+    category = frame['代码'].map(lambda c: categories.get(c, ""))
+    cat_w = category.map(lambda c: targets.get(c, 0.0) if c else 0.0).astype(float)
+    # 直接按代码指定了权重的基金不再参与类别分摊
+    cat_w = cat_w.where(fund_w == 0, 0.0)
+    in_cat = cat_w > 0
+    cat_value = frame['市值'].where(in_cat, 0.0).groupby(category).transform('sum')
+    cat_count = in_cat.groupby(category).transform('sum')
+    share = (frame['市值'] / cat_value).where(cat_value > 0, 1.0 / cat_count.where(cat_count > 0, 1))
+    return (fund_w + cat_w * share.where(in_cat, 0.0)) / total_weight
+
+
+def plan_rebalance_batch(portfolios, categories=None, min_trade=10.0, buy_fee=0.0015, sell_fee=0.005):
+    """
+    批量生成再平衡指令
+    portfolios: {用户: {"holdings": {代码: {"shares", ...}}, "prices": {代码: 价格},
+                       "targets": {基金代码或类别: 权重}, "cash": 可用现金}}
+    categories: {代码: 类别}，按类别设目标时需要
+    规则: 无法执行的目标 (见 split_rebalance_targets) 被忽略，其余目标按比例归一化，全部无法执行时该用户不下单；
+          先卖后买，卖出所得扣除卖出费后与现金一起作为买入预算，买入金额含申购费；
+          小于 min_trade 的调整不下单，预算不足时买单按比例缩减
+    返回 DataFrame (REBALANCE_COLUMNS)，每行一条指令
+    """
+    categories = categories or {}
+    frames = []
+    for user, p in portfolios.items():
+        prices = p.get('prices', {})
+        targets = p.get('targets', {})
+        codes = [c for c in dict.fromkeys(list(p['holdings']) + list(targets)) if prices.get(c)]
+        if not codes:
+            continue
+        reachable, _ = split_rebalance_targets(targets, codes, categories)
+        if sum(reachable.values()) <= 0:
+            # 没有任何可执行的目标时不下单，否则会把整个组合卖成现金
+            continue
+        frame = pd.DataFrame({
+            "用户": user,
+            "代码": codes,
+            "份额": [p['holdings'].get(c, {}).get('shares', 0.0) for c in codes],
+            "价格": [float(prices[c]) for c in codes],
+            "现金": float(p.get('cash', 0.0)),
+        })
+        frame['市值'] = frame['份额'] * frame['价格']
+        frame['目标权重'] = _target_weights(frame, reachable, categories)
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=REBALANCE_COLUMNS)
+
+    df = pd.concat(frames, ignore_index=True)
+    by_user = df.groupby('用户')
+    total = by_user['市值'].transform('sum') + df['现金']
+    diff = df['目标权重'] * total - df['市值']
+    # 小额调整忽略，减少指令数量
+    diff = diff.where(diff.abs() >= min_trade, 0.0)
+
+    # 卖出: 目标为 0 的整笔卖出，其余按差额
+    sell = (-diff).clip(lower=0.0)
+    sell = sell.where(df['目标权重'] > 0, df['市值'].where(df['市值'] >= min_trade, sell))
+    proceeds = sell * (1 - sell_fee)
+
+    # 买入: 要让到账市值达到目标，需支付 差额 / (1 - 申购费率)
+    buy = diff.clip(lower=0.0) / (1 - buy_fee)
+    budget = proceeds.groupby(df['用户']).transform('sum') + df['现金']
+    need = buy.groupby(df['用户']).transform('sum')
+    scale = (budget / need).where(need > budget, 1.0).fillna(1.0)
+    buy = buy * scale
+    buy = buy.where(buy >= min_trade, 0.0)
+
+    df['操作'] = None
+    df.loc[sell > 0, '操作'] = "卖出"
+    df.loc[buy > 0, '操作'] = "买入"
+    df['金额'] = sell + buy
+    df['份额'] = (sell / df['价格']).where(sell > 0, buy * (1 - buy_fee) / df['价格'])
+    df['预估费用'] = sell * sell_fee + buy * buy_fee
+
+    # 先卖后买，方便按顺序执行
+    df['顺序'] = df['操作'].map({"卖出": 0, "买入": 1})
+    orders = df[df['操作'].notna()].sort_values(['用户', '顺序'], kind='stable')
+    return orders[REBALANCE_COLUMNS].reset_index(drop=True)
+
+
+def plan_rebalance(holdings, prices, targets, cash=0.0, categories=None, **kwargs):
+    """单个组合的再平衡，参数同 plan_rebalance_batch"""
+    portfolios = {"": {"holdings": holdings, "prices": prices, "targets": targets, "cash": cash}}
+    return plan_rebalance_batch(portfolios, categories, **kwargs).drop(columns="用户")
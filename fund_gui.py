@@ -2,11 +2,13 @@
 import sys
 import json
 import os
+import time
 from PyQt6.QtWidgets import (QApplication, QWidget, QLabel,
                              QLineEdit, QPushButton, QVBoxLayout,
                              QHBoxLayout, QTableWidget, QTableWidgetItem,
-                             QHeaderView, QMessageBox, QAbstractItemView)
-from PyQt6.QtCore import Qt, QTimer
+                             QHeaderView, QMessageBox, QAbstractItemView,
+                             QInputDialog, QSystemTrayIcon, QStyle)
+from PyQt6.QtCore import Qt, QTimer, QThread, pyqtSignal
 from PyQt6.QtGui import QColor, QFont
 
 # 引入核心数据获取模块
@@ -14,22 +16,42 @@ import fund_core
 
 # 数据存储文件名
 DATA_FILE = "my_funds.json"
+ALERT_FILE = "my_alerts.json"
+SNAPSHOT_FILE = "my_funds_snapshot.json"
+
+
+class QuoteWorker(QThread):
+    """后台并发获取估值，完成后把结果发回界面线程"""
+    quotes_ready = pyqtSignal(dict)
+
+    def __init__(self, fund_codes):
+        super().__init__()
+        self.fund_codes = list(fund_codes)
+
+    def run(self):
+        self.quotes_ready.emit(fund_core.get_fund_real_time_values(self.fund_codes))
 
 
 class FundWindow(QWidget):
     def __init__(self):
         super().__init__()
         self.fund_list = []  # 存储基金代码的列表
+        self.alert_rules = []  # 价格提醒规则
         self.load_funds()  # 启动时读取本地保存的基金
+        self.load_alerts()
+        self.alert_engine = fund_core.AlertEngine(self.alert_rules)
+        self.worker = None  # 后台刷新线程
+        self.refresh_pending = False
         self.init_ui()
+        self.load_snapshot()  # 先展示上次的数据，不等网络
 
         # 启动自动刷新定时器 (每30秒)
         self.timer = QTimer()
         self.timer.timeout.connect(self.refresh_all_data)
         self.timer.start(30000)
 
-        # 启动后立即刷新一次
-        QTimer.singleShot(500, self.refresh_all_data)
+        # 启动后立即在后台刷新一次
+        QTimer.singleShot(0, self.refresh_all_data)
 
     def init_ui(self):
         self.setWindowTitle('我的基金看板 V2.0')
@@ -51,9 +73,13 @@ class FundWindow(QWidget):
         self.btn_delete = QPushButton("🗑 删除选中")
         self.btn_delete.clicked.connect(self.delete_fund)
 
+        self.btn_alert = QPushButton("🔔 涨跌提醒")
+        self.btn_alert.clicked.connect(self.add_alert)
+
         top_layout.addWidget(self.input_code)
         top_layout.addWidget(self.btn_add)
         top_layout.addWidget(self.btn_delete)
+        top_layout.addWidget(self.btn_alert)
         top_layout.addStretch()  # 弹簧，把按钮顶到左边
         top_layout.addWidget(self.btn_refresh)
 
@@ -80,6 +106,11 @@ class FundWindow(QWidget):
 
         self.setLayout(main_layout)
 
+        # --- 托盘图标 (用于弹出提醒) ---
+        self.tray = QSystemTrayIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_ComputerIcon), self)
+        self.tray.setToolTip('我的基金看板')
+        self.tray.show()
+
     def load_funds(self):
         """从本地文件读取基金列表"""
         if os.path.exists(DATA_FILE):
@@ -97,6 +128,44 @@ class FundWindow(QWidget):
         except Exception as e:
             print(f"保存失败: {e}")
 
+    def load_alerts(self):
+        """从本地文件读取提醒规则"""
+        if os.path.exists(ALERT_FILE):
+            try:
+                with open(ALERT_FILE, 'r', encoding='utf-8') as f:
+                    self.alert_rules = json.load(f)
+            except:
+                self.alert_rules = []
+
+    def save_alerts(self):
+        """保存提醒规则到本地文件"""
+        try:
+            with open(ALERT_FILE, 'w', encoding='utf-8') as f:
+                json.dump(self.alert_rules, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"保存失败: {e}")
+
+    def add_alert(self):
+        """给选中的基金添加 ±x% 涨跌提醒"""
+        current_row = self.table.currentRow()
+        if current_row < 0:
+            QMessageBox.warning(self, "提示", "请先点击选择要提醒的基金")
+            return
+        code = self.table.item(current_row, 0).text()
+
+        value, ok = QInputDialog.getDouble(self, "涨跌提醒", f"{code} 估算涨幅超过 ±x% 时提醒，x =", 2.0, 0.1, 20.0, 2)
+        if not ok:
+            return
+
+        # 同一基金的涨跌提醒只保留一组
+        self.alert_rules = [r for r in self.alert_rules if not (r['代码'] == code and r['类型'] == "涨幅")]
+        for direction, threshold in (("上破", value), ("下破", -value)):
+            self.alert_rules.append({"id": f"{code}_{direction}_{time.time_ns()}", "类型": "涨幅", "代码": code,
+                                     "方向": direction, "阈值": threshold})
+        self.save_alerts()
+        self.alert_engine.set_rules(self.alert_rules)
+        self.status_label.setText(f"已设置 {code} 涨跌 ±{value:.2f}% 提醒")
+
     def add_fund(self):
         """添加基金"""
         code = self.input_code.text().strip()
@@ -141,16 +210,52 @@ class FundWindow(QWidget):
                 self.refresh_all_data()
 
     def refresh_all_data(self):
-        """刷新所有基金数据"""
+        """在后台线程刷新所有基金数据，不阻塞界面"""
         if not self.fund_list:
             self.table.setRowCount(0)
             return
+        if self.worker is not None and self.worker.isRunning():
+            # 上一次刷新还没结束，结束后再刷一次
+            self.refresh_pending = True
+            return
 
         self.status_label.setText("正在刷新所有数据...")
+        self.worker = QuoteWorker(self.fund_list)
+        self.worker.quotes_ready.connect(self.on_quotes_ready)
+        # 线程真正结束后再处理排队的刷新，此时 isRunning() 已经是 False
+        self.worker.finished.connect(self.on_worker_finished)
+        self.worker.start()
+
+    def on_quotes_ready(self, quotes):
+        """后台刷新完成，用最新数据覆盖快照"""
+        self.render_table(quotes)
+        self.status_label.setText(f"刷新完成 - 共 {len(self.fund_list)} 只基金")
+        fund_core.save_quote_snapshot(SNAPSHOT_FILE, quotes, self.fund_list)
+
+        # 检查价格提醒，只评估估值有变化的基金
+        for alert in self.alert_engine.evaluate(quotes):
+            self.tray.showMessage("基金提醒", alert['消息'], QSystemTrayIcon.MessageIcon.Information, 5000)
+
+    def on_worker_finished(self):
+        """后台线程结束，执行刷新期间排队的那一次刷新"""
+        if self.refresh_pending:
+            self.refresh_pending = False
+            self.refresh_all_data()
+
+    def load_snapshot(self):
+        """启动时先展示上次保存的估值 (灰色表示非实时)"""
+        quotes, saved_at = fund_core.load_quote_snapshot(SNAPSHOT_FILE)
+        if not quotes or not self.fund_list:
+            return
+        self.render_table(quotes, stale=True)
+        self.status_label.setText(f"离线快照 (保存于 {saved_at})，正在获取最新数据...")
+
+    def render_table(self, quotes, stale=False):
+        """把估值填入表格"""
         self.table.setRowCount(len(self.fund_list))  # 设置行数
 
         for row, code in enumerate(self.fund_list):
-            data = fund_core.get_fund_real_time_value(code)
+            data = quotes.get(code)
 
             if data:
                 # 准备数据
@@ -162,10 +267,12 @@ class FundWindow(QWidget):
                     data['更新时间']
                 ]
 
-                # 颜色逻辑：涨红跌绿
+                # 颜色逻辑：涨红跌绿，快照数据统一显示为灰色
                 zhangfu = data['估算涨幅']
                 text_color = QColor("black")
-                if "-" in zhangfu:
+                if stale:
+                    text_color = QColor("gray")
+                elif "-" in zhangfu:
                     text_color = QColor("green")
                 elif zhangfu != "0.00%":
                     text_color = QColor("red")
@@ -175,17 +282,18 @@ class FundWindow(QWidget):
                     item = QTableWidgetItem(str(text))
                     # 涨跌幅和估值列设置颜色
                     if col in [2, 3]:
-                        item.setForeground(text_color)
                         item.setFont(QFont("Arial", 10, QFont.Weight.Bold))
+                    if col in [2, 3] or stale:
+                        item.setForeground(text_color)
 
                     # 内容居中
                     item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
                     self.table.setItem(row, col, item)
             else:
                 self.table.setItem(row, 0, QTableWidgetItem(code))
-                self.table.setItem(row, 1, QTableWidgetItem("获取失败"))
-
-        self.status_label.setText(f"刷新完成 - 共 {len(self.fund_list)} 只基金")
+                self.table.setItem(row, 1, QTableWidgetItem("等待刷新..." if stale else "获取失败"))
+                for col in range(2, 5):
+                    self.table.setItem(row, col, QTableWidgetItem(""))
 
 
 if __name__ == '__main__':
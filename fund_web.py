@@ -6,6 +6,7 @@ import os
 import datetime
 import requests
 import time
+import threading
 import fund_core  # 复用核心代码
 
 # --- 1. 页面配置 (保持宽屏) ---
@@ -132,49 +133,152 @@ def get_fund_history_data(code, days=30):
     return None
 
 
-total_assets = 0.0
-total_cost = 0.0
-today_profit = 0.0
-holdings_list = []
-latest_update_time = "等待刷新..."
+@st.cache_resource
+def get_wealth_curve_store():
+    # 进程级缓存: 每个用户一份已排序的净值序列，同一用户的多个标签页共用
+    return {"lock": threading.Lock(), "curves": {}}
+
+
+@st.cache_resource(ttl=3600)
+def get_holding_matrix(fund_codes, quarter):
+    # quarter 只用作缓存键，新季报披露后自动失效
+    portfolios = fund_core.get_fund_portfolios(fund_codes)
+    return fund_core.build_holding_matrix(portfolios)
+
+
+@st.cache_data(ttl=5, show_spinner=False)
+def get_cached_quotes(fund_codes):
+    # 并发获取，5 秒内同一组基金的估值在所有会话间共享
+    return fund_core.get_fund_real_time_values(fund_codes)
+
+
+def get_snapshot_file_path(username):
+    safe_name = username if username else "unknown"
+    return f"fund_snapshot_{safe_name}.json"
+
+
+@st.cache_resource
+def get_valuation_store():
+    # 进程级缓存: 每个用户一份估值备忘，同一用户的多个标签页共用
+    return {"lock": threading.Lock(), "memos": {}}
+
+
+@st.cache_resource
+def get_alert_engine_store():
+    # 进程级缓存: {用户: (规则签名, 提醒引擎)}，同一用户的多个标签页共享触发状态
+    return {"lock": threading.Lock(), "engines": {}}
+
+
+def evaluate_alerts(username, rules, quotes, holdings):
+    """用该用户共享的提醒引擎评估一次，多个标签页之间加锁"""
+    store = get_alert_engine_store()
+    signature = tuple((r['id'], r['阈值']) for r in rules)
+    with store['lock']:
+        cached = store['engines'].get(username)
+        if cached is None:
+            cached = (signature, fund_core.AlertEngine(rules))
+        elif cached[0] != signature:
+            cached[1].set_rules(rules)
+            cached = (signature, cached[1])
+        store['engines'][username] = cached
+        return cached[1].evaluate(quotes, holdings)
+
 
 # 🔥 修复核心3：安全读取 .get()
 holdings = st.session_state.data.get('holdings', {})
 
-if holdings:
-    for code, info in holdings.items():
-        real_data = fund_core.get_fund_real_time_value(code)
-        if real_data:
-            curr_price = float(real_data['实时估算值'])
-            zhangfu = float(real_data['估算涨幅'].replace('%', ''))
-            latest_update_time = real_data['更新时间']
-            market_val = info['shares'] * curr_price
-            cost = info['cost']
-            day_profit = market_val * (zhangfu / 100)
-            total_assets += market_val
-            total_cost += cost
-            today_profit += day_profit
-            holdings_list.append({
-                "代码": code,
-                "名称": f"{info['name']} ({code})",
-                "投入本金": cost,
-                "当前市值": market_val,
-                "今日涨幅(%)": f"{zhangfu:+.2f}%",
-                "今日收益": day_profit,
-                "持有收益": market_val - cost,
-                "持有收益率": (market_val - cost) / cost * 100 if cost > 0 else 0,
-                "更新时间": real_data['更新时间']
-            })
+valuation_store = get_valuation_store()
+
+# 本会话首次渲染时先用上次的估值秒开 (进程内已有该用户的估值就用内存里的，否则读本地快照)，
+# 页面画完后再拉取最新估值
+quotes_stale = False
+if not st.session_state.get('quotes_warmed') and holdings:
+    with valuation_store['lock']:
+        warm_memo = valuation_store['memos'].get(current_user)
+        if warm_memo and warm_memo.get('估值'):
+            snapshot_quotes, snapshot_time = dict(warm_memo['估值']), warm_memo['更新时间']
+        else:
+            snapshot_quotes, snapshot_time = fund_core.load_quote_snapshot(get_snapshot_file_path(current_user))
+    if snapshot_quotes:
+        quotes_stale = True
+st.session_state.quotes_warmed = True
+
+if not quotes_stale:
+    # 批量预取持仓基金的基础信息，之后各页面直接从内存读取 (快照渲染时推迟到页面画完之后)
+    fund_core.prefetch_fund_meta(holdings.keys())
+
+if quotes_stale:
+    quotes = {code: snapshot_quotes.get(code) for code in holdings}
+    # 快照只用于展示，不写入共享的估值备忘
+    valuation_memo = fund_core.new_valuation_memo()
+    holdings_list = fund_core.update_valuation(valuation_memo, holdings, quotes)
+else:
+    quotes = get_cached_quotes(tuple(holdings))
+    # 增量估值：只重算估值版本或持仓变化的基金，合计按差值更新
+    with valuation_store['lock']:
+        valuation_memo = valuation_store['memos'].setdefault(current_user, fund_core.new_valuation_memo())
+        holdings_list = fund_core.update_valuation(valuation_memo, holdings, quotes)
+        valuation_memo['估值'] = quotes
+        # 估值有更新时刷新本地快照
+        snapshot_key = tuple((code, quote['更新时间']) for code, quote in quotes.items() if quote)
+        if snapshot_key and valuation_memo.get('快照') != snapshot_key:
+            valuation_memo['快照'] = snapshot_key
+            fund_core.save_quote_snapshot(get_snapshot_file_path(current_user), quotes, holdings)
+
+total_assets = valuation_memo['总资产']
+total_cost = valuation_memo['总本金']
+today_profit = valuation_memo['今日收益']
+latest_update_time = valuation_memo['更新时间']
 
 total_profit_all = total_assets - total_cost
 total_rate = (total_profit_all / total_cost * 100) if total_cost > 0 else 0.0
 
 today_str = datetime.datetime.now().strftime("%Y-%m-%d")
-if total_assets > 0:
-    if st.session_state.data is not None:
+if total_assets > 0 and not quotes_stale:
+    if st.session_state.data is not None and st.session_state.data['asset_history'].get(today_str) != total_assets:
         st.session_state.data['asset_history'][today_str] = total_assets
         save_data(current_user, st.session_state.data)
 
+# --- 价格提醒：每次刷新只评估估值有变化的基金 ---
+alert_rules = st.session_state.data.get('alerts', [])
+if alert_rules and quotes and not quotes_stale:
+    for alert in evaluate_alerts(current_user, alert_rules, quotes, holdings):
+        st.toast(f"🔔 {alert['消息']}")
+
+
+# --- 交易柜台的买入 / 卖出 (再平衡也复用这两个函数) ---
+def apply_buy(code, name, price, buy_money, base_cost, base_shares, fee_rate=0.0):
+    """在买入前的本金/份额基础上买入 buy_money 元，fee_rate 为申购费率"""
+    # 计算本次买入的份额
+    new_shares_from_buy = buy_money * (1 - fee_rate) / price if price > 0 else 0.0
+
+    # 更新持仓数据
+    st.session_state.data['holdings'][code] = {
+        'name': name,
+        'shares': base_shares + new_shares_from_buy,
+        'cost': base_cost + buy_money
+    }
+
+    # 只有当实际有买入金额时才记录为“买入”交易
+    if buy_money > 0:
+        rec = {"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"), "type": "买入",
+               "code": code, "name": name, "amount": buy_money}
+        st.session_state.data['transactions'].insert(0, rec)
+
+
+def apply_sell(code, sell_shares, price, fee_rate=0.0):
+    """卖出 sell_shares 份，本金按份额比例扣减，fee_rate 为赎回费率"""
+    curr = st.session_state.data['holdings'][code]
+    sell_shares = min(sell_shares, curr['shares'])
+    cost_reduce = curr['cost'] * (sell_shares / curr['shares']) if curr['shares'] > 0 else 0
+    curr['shares'] -= sell_shares
+    curr['cost'] -= cost_reduce
+    if curr['shares'] < 0.01: del st.session_state.data['holdings'][code]
+
+    rec = {"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"), "type": "卖出",
+           "code": code, "name": curr['name'], "amount": sell_shares * price * (1 - fee_rate)}
+    st.session_state.data['transactions'].insert(0, rec)
+
 
 # --- 新增：删除持仓基金的函数 ---
 def delete_holding_fund(fund_code_to_delete):
@@ -221,7 +325,7 @@ with st.sidebar:
 
     st.markdown("##### 功能导航")
     # 侧边栏导航名称修改，更符合“添加持仓”的语境
-    page = st.radio("功能导航", ["🏠 资产看板", "📝 交易明细", "🚀 添加持仓 & 交易"], label_visibility="collapsed")
+    page = st.radio("功能导航", ["🏠 资产看板", "📝 交易明细", "🚀 添加持仓 & 交易", "🔔 价格提醒", "⚖️ 再平衡"], label_visibility="collapsed")
 
     st.markdown("---")
 
@@ -256,7 +360,11 @@ if page == "🏠 资产看板":
     with col_title:
         st.title("资产看板")
     with col_status:
-        if latest_update_time != "等待刷新...":
+        if quotes_stale:
+            st.markdown(
+                f'<div style="text-align:right; padding-top:15px;"><span class="status-badge"><span class="status-dot" style="background-color:#aaa;"></span>快照 {snapshot_time} · 更新中</span></div>',
+                unsafe_allow_html=True)
+        elif latest_update_time != "等待刷新...":
             st.markdown(
                 f'<div style="text-align:right; padding-top:15px;"><span class="status-badge"><span class="status-dot"></span>更新: {latest_update_time}</span></div>',
                 unsafe_allow_html=True)
@@ -277,9 +385,17 @@ if page == "🏠 资产看板":
     if st.session_state.data and 'asset_history' in st.session_state.data:
         history_data = st.session_state.data['asset_history']
         if len(history_data) > 1:
-            chart_df = pd.DataFrame(list(history_data.items()), columns=['日期', '总资产'])
-            chart_df['日期'] = pd.to_datetime(chart_df['日期'])
-            st.line_chart(chart_df.set_index('日期'), color="#e63946")
+            # 每个用户缓存一份已解析的序列，只增量更新今日的点
+            range_labels = {"近1月": "1M", "近6月": "6M", "近1年": "1Y", "全部": "ALL"}
+            range_label = st.radio("区间", list(range_labels.keys()), index=3, horizontal=True,
+                                   label_visibility="collapsed", key="wealth_range")
+
+            curve_store = get_wealth_curve_store()
+            with curve_store['lock']:
+                curve = fund_core.update_wealth_curve(curve_store['curves'].get(current_user), history_data)
+                curve_store['curves'][current_user] = curve
+                chart_df = fund_core.get_wealth_chart_df(curve, range_labels[range_label])
+            st.line_chart(chart_df, color="#e63946")
         else:
             st.info("📊 暂无历史数据")
     else:
@@ -300,14 +416,10 @@ if page == "🏠 资产看板":
         for idx, fund_item in enumerate(holdings_list):
             cols_data = st.columns(col_widths)
 
-            # 颜色逻辑：涨红跌绿
-            today_change_pct_val = float(fund_item['今日涨幅(%)'].replace('%', ''))
-            today_profit_val = fund_item['今日收益']
-            holding_profit_val = fund_item['持有收益']
-
-            color_today_change = 'red' if today_change_pct_val > 0 else 'green' if today_change_pct_val < 0 else 'black'
-            color_today_profit = 'red' if today_profit_val > 0 else 'green' if today_profit_val < 0 else 'black'
-            color_holding_profit = 'red' if holding_profit_val > 0 else 'green' if holding_profit_val < 0 else 'black'
+            # 颜色逻辑：涨红跌绿 (估值时已算好)
+            color_today_change = fund_item['今日涨幅颜色']
+            color_today_profit = fund_item['今日收益颜色']
+            color_holding_profit = fund_item['持有收益颜色']
 
             with cols_data[0]:
                 st.write(idx + 1)
@@ -339,6 +451,33 @@ if page == "🏠 资产看板":
     else:
         st.caption("暂无持仓")
 
+    # 快照渲染时不展示，避免首屏等待持仓数据的网络请求
+    if holdings_list and not quotes_stale:
+        with st.expander("🔍 穿透持仓分析 (基于最新季报重仓)"):
+            fund_codes = tuple(sorted(item['代码'] for item in holdings_list))
+            with st.spinner("加载基金持仓..."):
+                holding_matrix = get_holding_matrix(fund_codes, fund_core.get_latest_disclosed_quarter())
+            position_values = {item['代码']: item['当前市值'] for item in holdings_list}
+            security_df, sector_df = fund_core.calc_look_through_exposure(position_values, holding_matrix)
+
+            if security_df.empty:
+                st.info("暂无持仓披露数据")
+            else:
+                col_stock, col_sector = st.columns([3, 2])
+                with col_stock:
+                    st.markdown("**重仓证券暴露 Top 20**")
+                    st.dataframe(
+                        security_df.head(20)[['名称', '代码', '行业', '暴露金额', '占总资产']],
+                        use_container_width=True, hide_index=True,
+                        column_config={
+                            "暴露金额": st.column_config.NumberColumn(format="%.2f"),
+                            "占总资产": st.column_config.NumberColumn(format="%.2f%%"),
+                        })
+                with col_sector:
+                    st.markdown("**行业暴露**")
+                    st.bar_chart(sector_df.set_index('行业')['占总资产'], color="#2979ff")
+                st.caption("仅统计基金披露的前十大重仓，实际暴露可能更高。")
+
     if auto_refresh:
         time.sleep(5)
         st.rerun()
@@ -372,7 +511,7 @@ elif page == "🚀 添加持仓 & 交易":
                     fund_info = fund_core.get_fund_real_time_value(search_code)
 
                 if fund_info:
-                    st.success(f"已锁定: {fund_info['名称']}")
+                    st.success(f"已锁定: {fund_core.get_fund_name(search_code, fund_info)}")
                     st.metric("实时估值", fund_info['实时估算值'], fund_info['估算涨幅'], delta_color="inverse")
                 else:
                     st.error("❌ 查无此基")
@@ -423,10 +562,7 @@ elif page == "🚀 添加持仓 & 交易":
                         st.warning("买入金额不能小于0。")
                     else: # fund_info is valid and buy_money >= 0
                         price = float(fund_info['实时估算值'])
-                        name = fund_info['名称']
-
-                        # 计算本次买入的份额
-                        new_shares_from_buy = buy_money / price if price > 0 else 0.0
+                        name = fund_core.get_fund_name(search_code, fund_info)
 
                         # 根据用户输入或默认值确定本次买入前的基金状态
                         base_cost_for_fund = input_original_principal
@@ -434,22 +570,9 @@ elif page == "🚀 添加持仓 & 交易":
                         base_market_value_for_fund = input_original_principal + input_existing_profit
                         base_shares_for_fund = base_market_value_for_fund / price if price > 0 else 0.0
 
-                        # 计算本次买入后的最终总份额和总成本
-                        final_shares = base_shares_for_fund + new_shares_from_buy
-                        final_cost = base_cost_for_fund + buy_money
+                        apply_buy(search_code, name, price, buy_money, base_cost_for_fund, base_shares_for_fund)
 
-                        # 更新持仓数据
-                        st.session_state.data['holdings'][search_code] = {
-                            'name': name,
-                            'shares': final_shares,
-                            'cost': final_cost
-                        }
-
-                        # 只有当实际有买入金额时才记录为“买入”交易
                         if buy_money > 0:
-                            rec = {"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"), "type": "买入",
-                                   "code": search_code, "name": name, "amount": buy_money}
-                            st.session_state.data['transactions'].insert(0, rec)
                             st.success(f"买入成功！基金 {name} ({search_code}) 已更新。")
                         else: # buy_money == 0, 视为持仓调整
                             st.success(f"基金 {name} ({search_code}) 持仓数据已调整。")
@@ -484,14 +607,7 @@ elif page == "🚀 添加持仓 & 交易":
 
                     if st.button("确认卖出", use_container_width=True):
                         if sell_shares > 0:
-                            cost_reduce = curr['cost'] * (sell_shares / curr['shares']) if curr['shares'] > 0 else 0
-                            curr['shares'] -= sell_shares
-                            curr['cost'] -= cost_reduce
-                            if curr['shares'] < 0.01: del st.session_state.data['holdings'][sell_code_select]
-
-                            rec = {"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"), "type": "卖出",
-                                   "code": sell_code_select, "name": curr['name'], "amount": sell_shares * curr_price}
-                            st.session_state.data['transactions'].insert(0, rec)
+                            apply_sell(sell_code_select, sell_shares, curr_price)
                             save_data(current_user, st.session_state.data)
                             st.success("卖出成功！")
                             time.sleep(1)
@@ -503,7 +619,18 @@ elif page == "🚀 添加持仓 & 交易":
 
     with col_right:
         if len(search_code) == 6 and fund_info:
-            st.markdown(f"#### 📊 {fund_info['名称']} 深度分析")
+            st.markdown(f"#### 📊 {fund_core.get_fund_name(search_code, fund_info)} 深度分析")
+
+            fund_meta = fund_core.get_fund_meta(search_code)
+            if fund_meta:
+                meta_parts = [
+                    fund_meta.get('类型', ''),
+                    f"经理: {fund_meta['基金经理']} (任职 {fund_meta.get('任职日期', '-')})" if fund_meta.get('基金经理') else "",
+                    f"成立: {fund_meta['成立日期']}" if fund_meta.get('成立日期') else "",
+                    f"申购费率: {fund_meta['申购费率']}" if fund_meta.get('申购费率') else "",
+                    "QDII" if fund_meta.get('QDII') else "",
+                ]
+                st.caption(" | ".join(p for p in meta_parts if p))
 
             with st.spinner("加载业绩走势..."):
                 chart_df = get_fund_history_data(search_code, days=30)
@@ -547,9 +674,184 @@ elif page == "🚀 添加持仓 & 交易":
         else:
             st.info("👈 请在左侧输入基金代码")
 
+# ================= 页面 4: 价格提醒 =================
+elif page == "🔔 价格提醒":
+    st.title("价格提醒")
+    st.caption("每次刷新估值时检查，触发后当天不再重复提醒。")
+    alert_rules = st.session_state.data.setdefault('alerts', [])
+
+    with st.container(border=True):
+        st.markdown("#### ➕ 新建提醒")
+        type_labels = {f"{k} - {v}": k for k, v in fund_core.ALERT_TYPES.items()}
+        col_type, col_code, col_dir, col_val = st.columns([2, 2, 1.5, 1.5])
+        with col_type:
+            alert_type = type_labels[st.selectbox("提醒类型", list(type_labels.keys()))]
+        with col_code:
+            if alert_type == "日收益":
+                alert_code = fund_core.PORTFOLIO_CODE
+                st.text_input("基金", value="整个组合", disabled=True)
+            else:
+                alert_code = st.selectbox("基金", list(holdings.keys()),
+                                          format_func=lambda c: f"{holdings[c]['name']} ({c})")
+        with col_dir:
+            directions = ["上破", "下破", "双向 ±"] if alert_type == "涨幅" else ["上破", "下破"]
+            alert_dir = st.selectbox("方向", directions)
+        with col_val:
+            alert_value = st.number_input("阈值", value=0.0, step=0.5)
+
+        if st.button("添加提醒", type="primary"):
+            if not alert_code:
+                st.warning("请先添加持仓。")
+            else:
+                new_rules = [(alert_dir, alert_value)]
+                if alert_dir == "双向 ±":
+                    new_rules = [("上破", abs(alert_value)), ("下破", -abs(alert_value))]
+                for direction, threshold in new_rules:
+                    alert_rules.append({"id": str(time.time_ns()), "类型": alert_type, "代码": alert_code,
+                                        "方向": direction, "阈值": threshold})
+                save_data(current_user, st.session_state.data)
+                st.rerun()
+
+    st.markdown("**📋 已设置的提醒**")
+    if alert_rules:
+        for rule in list(alert_rules):
+            col_desc, col_op = st.columns([6, 1])
+            with col_desc:
+                target = "整个组合" if rule['代码'] == fund_core.PORTFOLIO_CODE else \
+                    f"{holdings.get(rule['代码'], {}).get('name', '')} ({rule['代码']})"
+                st.write(f"{target} · {fund_core.ALERT_TYPES[rule['类型']]} {rule['方向']} {rule['阈值']:.2f}")
+            with col_op:
+                if st.button("删除", key=f"del_alert_{rule['id']}"):
+                    alert_rules.remove(rule)
+                    save_data(current_user, st.session_state.data)
+                    st.rerun()
+    else:
+        st.caption("暂无提醒")
+
+# ================= 页面 5: 再平衡 =================
+elif page == "⚖️ 再平衡":
+    st.title("再平衡")
+    st.caption("设定目标权重，按最新估值计算需要的买卖指令 (先卖后买)。小于最小交易金额的调整会被忽略。")
+
+    if quotes_stale:
+        st.warning("正在获取最新估值，请稍候...")
+    elif not holdings_list:
+        st.info("暂无持仓")
+    else:
+        rebalance_cfg = st.session_state.data.setdefault('rebalance_targets', {"mode": "按基金", "weights": {}})
+        mode = st.radio("目标维度", ["按基金", "按类别"], horizontal=True,
+                        index=0 if rebalance_cfg.get('mode', "按基金") == "按基金" else 1)
+
+        categories = {code: fund_core.get_fund_meta(code).get('类型') or "未分类" for code in holdings}
+        position_values = {item['代码']: item['当前市值'] for item in holdings_list}
+        total_value = sum(position_values.values())
+        saved_weights = rebalance_cfg.get('weights', {}) if rebalance_cfg.get('mode') == mode else {}
+
+        if mode == "按基金":
+            keys = list(dict.fromkeys(list(holdings) + list(saved_weights)))
+            labels = [f"{holdings[k]['name']} ({k})" if k in holdings else k for k in keys]
+            current = [position_values.get(k, 0.0) for k in keys]
+        else:
+            keys = list(dict.fromkeys(list(categories.values()) + list(saved_weights)))
+            labels = keys
+            current = [sum(v for c, v in position_values.items() if categories.get(c) == k) for k in keys]
+
+        target_df = pd.DataFrame({
+            "目标": keys,
+            "说明": labels,
+            "当前占比(%)": [v / total_value * 100 if total_value > 0 else 0.0 for v in current],
+            "目标占比(%)": [float(saved_weights.get(k, 0.0)) for k in keys],
+        })
+        edited_df = st.data_editor(
+            target_df, use_container_width=True, hide_index=True, num_rows="dynamic", key=f"rebalance_{mode}",
+            disabled=["说明", "当前占比(%)"],
+            column_config={
+                "目标": st.column_config.TextColumn(help="基金代码或类别名称，可新增基金代码"),
+                "当前占比(%)": st.column_config.NumberColumn(format="%.2f"),
+                "目标占比(%)": st.column_config.NumberColumn(min_value=0.0, max_value=100.0, format="%.2f"),
+            })
+        weights = {str(row['目标']).strip(): float(row['目标占比(%)']) if pd.notna(row['目标占比(%)']) else 0.0
+                   for _, row in edited_df.iterrows() if pd.notna(row['目标']) and str(row['目标']).strip()}
+        st.caption(f"目标合计: {sum(weights.values()):.2f}% (会自动归一化，未列出的基金目标为 0)")
+
+        col_cash, col_min, col_buy_fee, col_sell_fee = st.columns(4)
+        with col_cash:
+            cash = st.number_input("可用现金 (元)", min_value=0.0, step=100.0)
+        with col_min:
+            min_trade = st.number_input("最小交易金额 (元)", min_value=0.0, value=10.0, step=10.0)
+        with col_buy_fee:
+            buy_fee_pct = st.number_input("申购费率 (%)", min_value=0.0, max_value=5.0, value=0.15, step=0.05)
+        with col_sell_fee:
+            sell_fee_pct = st.number_input("赎回费率 (%)", min_value=0.0, max_value=5.0, value=0.5, step=0.1)
+
+        if sum(weights.values()) <= 0:
+            st.info("请填写目标占比")
+        else:
+            plan_quotes = dict(quotes)
+            new_codes = tuple(k for k in weights if mode == "按基金" and k not in plan_quotes)
+            if new_codes:
+                plan_quotes.update(get_cached_quotes(new_codes))
+            prices = {code: float(q['实时估算值']) for code, q in plan_quotes.items() if q}
+            plan_categories = categories if mode == "按类别" else None
+            reachable, dropped = fund_core.split_rebalance_targets(weights, prices.keys(), plan_categories)
+            if sum(reachable.values()) <= 0:
+                st.error(f"所有目标都无法执行 (取不到估值或该类别下没有基金): {', '.join(dropped)}，未生成调仓指令。")
+            else:
+                if dropped:
+                    st.warning(f"以下目标无法执行 (取不到估值或该类别下没有基金)，已忽略，其余目标按比例放大: "
+                               f"{', '.join(dropped)}")
+
+                orders = fund_core.plan_rebalance(
+                    holdings, prices, weights, cash=cash, categories=plan_categories,
+                    min_trade=min_trade, buy_fee=buy_fee_pct / 100, sell_fee=sell_fee_pct / 100)
+
+                st.markdown("**📋 调仓指令**")
+                if orders.empty:
+                    st.success("当前持仓已接近目标，无需调整。")
+                else:
+                    names = {code: fund_core.get_fund_name(code, plan_quotes.get(code)) for code in orders['代码']}
+                    show_orders = orders.assign(名称=orders['代码'].map(names))
+                    st.dataframe(
+                        show_orders[['操作', '名称', '代码', '金额', '份额', '价格', '预估费用']],
+                        use_container_width=True, hide_index=True,
+                        column_config={
+                            "金额": st.column_config.NumberColumn(format="%.2f"),
+                            "份额": st.column_config.NumberColumn(format="%.2f"),
+                            "价格": st.column_config.NumberColumn(format="%.4f"),
+                            "预估费用": st.column_config.NumberColumn(format="%.2f"),
+                        })
+                    st.caption(f"共 {len(orders)} 笔，预估费用合计 {orders['预估费用'].sum():,.2f} 元")
+
+                    if st.button("✅ 按计划执行", type="primary"):
+                        # 指令已按先卖后买排序，通过交易柜台的买卖逻辑逐笔执行
+                        for order in orders.itertuples(index=False):
+                            if order.操作 == "卖出":
+                                apply_sell(order.代码, order.份额, order.价格, sell_fee_pct / 100)
+                            else:
+                                base = st.session_state.data['holdings'].get(order.代码, {})
+                                apply_buy(order.代码, base.get('name') or names.get(order.代码, order.代码), order.价格,
+                                          order.金额, base.get('cost', 0.0), base.get('shares', 0.0), buy_fee_pct / 100)
+                        st.session_state.data['rebalance_targets'] = {"mode": mode, "weights": weights}
+                        save_data(current_user, st.session_state.data)
+                        st.success("再平衡已执行！")
+                        time.sleep(1)
+                        st.rerun()
+
+        if st.button("💾 保存目标"):
+            st.session_state.data['rebalance_targets'] = {"mode": mode, "weights": weights}
+            save_data(current_user, st.session_state.data)
+            st.success("目标已保存")
+
 # --- 7. 底部版权 ---
 st.markdown("""
     <div class="brand-footer">
         Designed by 抖音：<b>绿豆生北国</b> (ID: 32053858729)
     </div>
 """, unsafe_allow_html=True)
+
+# 快照页面已经画完，这里再同步最新估值 (写入缓存) 和基础信息后重新渲染
+if quotes_stale:
+    with st.spinner("正在获取最新估值..."):
+        get_cached_quotes(tuple(holdings))
+        fund_core.prefetch_fund_meta(holdings.keys())
+    st.rerun()